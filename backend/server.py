@@ -3,18 +3,23 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import base64
+import gzip
+import io
+from PIL import Image
 from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
 import asyncio
+import contextlib
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -31,6 +36,14 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
 JWT_ALGORITHM = 'HS256'
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', '')
 
+SCAN_ARCHIVE_DIR = Path(os.environ.get('SCAN_ARCHIVE_DIR', str(ROOT_DIR / 'scan_archive')))
+SCAN_ARCHIVE_AFTER_DAYS = int(os.environ.get('SCAN_ARCHIVE_AFTER_DAYS', '30'))
+SCAN_COMPACTION_INTERVAL_SECONDS = int(os.environ.get('SCAN_COMPACTION_INTERVAL_SECONDS', '3600'))
+SCAN_COMPACTION_BATCH_SIZE = int(os.environ.get('SCAN_COMPACTION_BATCH_SIZE', '50'))
+SCAN_COMPACTION_THROTTLE_SECONDS = float(os.environ.get('SCAN_COMPACTION_THROTTLE_SECONDS', '0.2'))
+SCAN_COMPACTION_INITIAL_DELAY_SECONDS = int(os.environ.get('SCAN_COMPACTION_INITIAL_DELAY_SECONDS', '600'))
+THUMBNAIL_SIZE = (256, 256)
+
 class UserRegister(BaseModel):
     email: EmailStr
     password: str
@@ -98,6 +111,140 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def make_thumbnail(image_base64: str) -> Optional[str]:
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+        image = image.convert('RGB')
+        image.thumbnail(THUMBNAIL_SIZE)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=70, optimize=True)
+        return base64.b64encode(buffer.getvalue()).decode('ascii')
+    except Exception as e:
+        logging.warning(f"Thumbnail error: {str(e)}")
+        return None
+
+def write_archived_image(user_id: str, scan_id: str, image_base64: str) -> Tuple[str, int]:
+    """Durably write an image to the archive and verify it reads back intact.
+
+    The caller removes the only other copy from Mongo afterwards, so the file
+    and its directory entry are fsynced before the contents are checked.
+    """
+    relative_path = Path(user_id) / f"{scan_id}.b64.gz"
+    path = SCAN_ARCHIVE_DIR / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9) as f:
+            f.write(image_base64.encode('ascii'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    size = tmp_path.stat().st_size
+    os.replace(tmp_path, path)
+    dir_fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    if read_archived_image(relative_path.as_posix()) != image_base64:
+        raise ValueError(f"archive verification failed for {relative_path.as_posix()}")
+    return relative_path.as_posix(), size
+
+def read_archived_image(relative_path: str) -> str:
+    with gzip.open(SCAN_ARCHIVE_DIR / relative_path, 'rb') as f:
+        return f.read().decode('ascii')
+
+async def compact_scan_images(
+    max_age_days: int = SCAN_ARCHIVE_AFTER_DAYS,
+    batch_size: int = SCAN_COMPACTION_BATCH_SIZE,
+    throttle_seconds: float = SCAN_COMPACTION_THROTTLE_SECONDS,
+    deadline: Optional[datetime] = None,
+) -> dict:
+    """Move full-size images of old scans into the compressed archive tier.
+
+    Walks a single cursor over unarchived scans in ``created_at`` order, so
+    scans that fail are skipped rather than retried within the same run.
+    Stops early once ``deadline`` has passed.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=max_age_days)).isoformat()
+    query = {
+        "image_archive": None,
+        "created_at": {"$lt": cutoff},
+        "image_base64": {"$exists": True},
+    }
+    stats = {"archived": 0, "failed": 0, "bytes_reclaimed": 0, "archive_bytes": 0}
+
+    cursor = db.scans.find(
+        query, {"_id": 0, "id": 1, "user_id": 1, "image_base64": 1}
+    ).sort("created_at", 1).batch_size(batch_size)
+    try:
+        async for scan in cursor:
+            if deadline and datetime.now(timezone.utc) >= deadline:
+                break
+            try:
+                image_base64 = scan['image_base64']
+                thumbnail = await asyncio.to_thread(make_thumbnail, image_base64)
+                if not thumbnail:
+                    raise ValueError("could not create thumbnail")
+                relative_path, archive_size = await asyncio.to_thread(
+                    write_archived_image, scan['user_id'], scan['id'], image_base64
+                )
+                result = await db.scans.update_one(
+                    {"id": scan['id'], "image_archive": None},
+                    {
+                        "$set": {
+                            "thumbnail_base64": thumbnail,
+                            "image_archive": relative_path,
+                            "archived_at": datetime.now(timezone.utc).isoformat(),
+                        },
+                        "$unset": {"image_base64": ""},
+                    },
+                )
+                if result.modified_count:
+                    stats['archived'] += 1
+                    stats['bytes_reclaimed'] += len(image_base64) - len(thumbnail)
+                    stats['archive_bytes'] += archive_size
+            except Exception as e:
+                stats['failed'] += 1
+                logging.error(f"Compaction error for scan {scan.get('id')}: {str(e)}")
+            await asyncio.sleep(throttle_seconds)
+    finally:
+        await cursor.close()
+
+    return stats
+
+async def acquire_job_lease(name: str, seconds: int) -> Optional[datetime]:
+    """Take the named job lease if it is free; returns its expiry or None."""
+    now = datetime.now(timezone.utc)
+    lease_until = now + timedelta(seconds=seconds)
+    try:
+        await db.jobs.find_one_and_update(
+            {"_id": name, "locked_until": {"$lt": now.isoformat()}},
+            {"$set": {"locked_until": lease_until.isoformat()}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return None
+    return lease_until
+
+async def run_scan_compaction():
+    # Every worker runs this loop; the lease in db.jobs lets one of them
+    # compact per interval, and is left to expire so the others skip it.
+    await asyncio.sleep(SCAN_COMPACTION_INITIAL_DELAY_SECONDS)
+    while True:
+        try:
+            lease_until = await acquire_job_lease('scan_compaction', SCAN_COMPACTION_INTERVAL_SECONDS)
+            if lease_until:
+                stats = await compact_scan_images(deadline=lease_until)
+                if stats['archived'] or stats['failed']:
+                    logging.info(
+                        f"Scan compaction: archived {stats['archived']} images, "
+                        f"reclaimed {stats['bytes_reclaimed']} bytes from Mongo, "
+                        f"wrote {stats['archive_bytes']} archive bytes, {stats['failed']} failed"
+                    )
+        except Exception as e:
+            logging.error(f"Scan compaction error: {str(e)}")
+        await asyncio.sleep(SCAN_COMPACTION_INTERVAL_SECONDS)
+
 @api_router.post("/auth/register")
 async def register(user_data: UserRegister):
     existing = await db.users.find_one({"email": user_data.email}, {"_id": 0})
@@ -207,6 +354,10 @@ async def get_scans(user_id: str = Depends(get_current_user)):
     for scan in scans:
         if isinstance(scan['created_at'], str):
             scan['created_at'] = datetime.fromisoformat(scan['created_at'])
+        scan.pop('archived_at', None)
+        if scan.pop('image_archive', None):
+            scan['image_base64'] = scan.get('thumbnail_base64')
+        scan.pop('thumbnail_base64', None)
     return scans
 
 @api_router.get("/scans/{scan_id}")
@@ -216,6 +367,16 @@ async def get_scan(scan_id: str, user_id: str = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Scan not found")
     if isinstance(scan['created_at'], str):
         scan['created_at'] = datetime.fromisoformat(scan['created_at'])
+    scan.pop('archived_at', None)
+    image_archive = scan.pop('image_archive', None)
+    thumbnail = scan.pop('thumbnail_base64', None)
+    if image_archive:
+        try:
+            scan['image_base64'] = await asyncio.to_thread(read_archived_image, image_archive)
+        except Exception as e:
+            logging.error(f"Archive read error for scan {scan_id}: {str(e)}")
+            scan['image_base64'] = thumbnail
+            scan['image_degraded'] = True
     return scan
 
 @api_router.get("/diseases")
@@ -294,6 +455,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_scan_compaction():
+    try:
+        await db.scans.create_index([("image_archive", 1), ("created_at", 1)])
+    except Exception as e:
+        logging.error(f"Scan index error: {str(e)}")
+    app.state.compaction_task = asyncio.create_task(run_scan_compaction())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.compaction_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await app.state.compaction_task
     client.close()
\ No newline at end of file
@@ -0,0 +1,243 @@
+import asyncio
+import base64
+import io
+import sys
+import types
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from PIL import Image
+
+# server.py imports the private LLM SDK at module level; none of the code
+# under test calls it, so stand in a placeholder when it isn't installed.
+llm_chat = types.ModuleType('emergentintegrations.llm.chat')
+llm_chat.LlmChat = llm_chat.UserMessage = llm_chat.ImageContent = object
+sys.modules.setdefault('emergentintegrations', types.ModuleType('emergentintegrations'))
+sys.modules.setdefault('emergentintegrations.llm', types.ModuleType('emergentintegrations.llm'))
+sys.modules.setdefault('emergentintegrations.llm.chat', llm_chat)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+import server
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        value = doc.get(key)
+        if cond is None:
+            if value is not None:
+                return False
+        elif isinstance(cond, dict):
+            if '$lt' in cond and not (value is not None and value < cond['$lt']):
+                return False
+            if '$exists' in cond and (key in doc) != cond['$exists']:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def project(doc, projection):
+    included = [k for k, v in projection.items() if v and k != '_id']
+    if included:
+        return {k: doc[k] for k in included if k in doc}
+    return {k: v for k, v in doc.items() if k != '_id'}
+
+
+class FakeCursor:
+    def __init__(self, docs, projection):
+        self.docs = docs
+        self.projection = projection
+        self.closed = False
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield project(doc, self.projection)
+
+    async def to_list(self, length):
+        return [project(doc, self.projection) for doc in self.docs[:length]]
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query, projection):
+        self.queries.append(query)
+        return FakeCursor([d for d in self.docs if matches(d, query)], projection)
+
+    async def find_one(self, query, projection):
+        for doc in self.docs:
+            if matches(doc, query):
+                return project(doc, projection)
+        return None
+
+    async def update_one(self, query, update):
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(update.get('$set', {}))
+                for key in update.get('$unset', {}):
+                    doc.pop(key, None)
+                return SimpleNamespace(modified_count=1)
+        return SimpleNamespace(modified_count=0)
+
+
+def make_image_base64(size=(800, 600)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'green').save(buffer, format='JPEG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def make_scan(scan_id, age_days, **fields):
+    created_at = datetime.now(timezone.utc) - timedelta(days=age_days)
+    doc = {
+        'id': scan_id,
+        'user_id': 'user-1',
+        'image_base64': make_image_base64(),
+        'disease_detected': 'Healthy',
+        'created_at': created_at.isoformat(),
+    }
+    doc.update(fields)
+    return doc
+
+
+@pytest.fixture
+def scans(monkeypatch, tmp_path):
+    collection = FakeCollection([])
+    monkeypatch.setattr(server, 'db', SimpleNamespace(scans=collection))
+    monkeypatch.setattr(server, 'SCAN_ARCHIVE_DIR', tmp_path)
+    return collection
+
+
+def compact(**kwargs):
+    return asyncio.run(server.compact_scan_images(max_age_days=30, throttle_seconds=0, **kwargs))
+
+
+def test_archive_round_trip(scans, tmp_path):
+    image = make_image_base64()
+    relative_path, size = server.write_archived_image('user-1', 'scan-1', image)
+
+    assert relative_path == 'user-1/scan-1.b64.gz'
+    assert (tmp_path / relative_path).stat().st_size == size
+    assert size < len(image)
+    assert list((tmp_path / 'user-1').iterdir()) == [tmp_path / relative_path]
+    assert server.read_archived_image(relative_path) == image
+
+
+def test_compaction_archives_only_old_unarchived_scans(scans, tmp_path):
+    old = make_scan('old', 45)
+    image = old['image_base64']
+    recent = make_scan('recent', 2)
+    archived = make_scan('archived', 60, image_archive='user-1/archived.b64.gz')
+    scans.docs.extend([old, recent, archived])
+
+    stats = compact()
+
+    assert stats['archived'] == 1
+    assert stats['failed'] == 0
+    assert stats['archive_bytes'] == (tmp_path / 'user-1/old.b64.gz').stat().st_size
+    assert stats['bytes_reclaimed'] == len(image) - len(old['thumbnail_base64'])
+    assert 'image_base64' not in old
+    assert old['image_archive'] == 'user-1/old.b64.gz'
+    assert old['archived_at']
+    assert Image.open(io.BytesIO(base64.b64decode(old['thumbnail_base64']))).size[0] <= 256
+    assert server.read_archived_image(old['image_archive']) == image
+    assert 'image_archive' not in recent
+    assert archived['image_base64']
+
+
+def test_compaction_skips_scans_without_thumbnail(scans):
+    broken = [make_scan(f'broken-{i}', 50 - i, image_base64='bm90IGFuIGltYWdl') for i in range(3)]
+    good = make_scan('good', 40)
+    scans.docs.extend(broken + [good])
+
+    stats = compact(batch_size=2)
+
+    assert stats['failed'] == 3
+    assert stats['archived'] == 1
+    assert all('image_archive' not in doc and doc['image_base64'] for doc in broken)
+    assert good['image_archive'] == 'user-1/good.b64.gz'
+    assert len(scans.queries) == 1
+
+
+def test_compaction_keeps_image_when_archive_does_not_verify(scans, monkeypatch):
+    scan = make_scan('old', 45)
+    image = scan['image_base64']
+    scans.docs.append(scan)
+    monkeypatch.setattr(server, 'read_archived_image', lambda relative_path: '')
+
+    stats = compact()
+
+    assert stats['failed'] == 1
+    assert stats['archived'] == 0
+    assert scan['image_base64'] == image
+    assert 'image_archive' not in scan
+
+
+def test_compaction_stops_at_deadline(scans):
+    scans.docs.append(make_scan('old', 45))
+
+    stats = compact(deadline=datetime.now(timezone.utc))
+
+    assert stats['archived'] == 0
+    assert 'image_archive' not in scans.docs[0]
+
+
+def test_get_scan_rehydrates_archived_image(scans):
+    scan = make_scan('old', 45)
+    image = scan['image_base64']
+    scans.docs.append(scan)
+    compact()
+
+    result = asyncio.run(server.get_scan('old', user_id='user-1'))
+
+    assert result['image_base64'] == image
+    assert 'thumbnail_base64' not in result
+    assert 'image_archive' not in result
+    assert 'archived_at' not in result
+    assert 'image_degraded' not in result
+
+
+def test_get_scan_marks_missing_archive_as_degraded(scans, tmp_path):
+    scan = make_scan('old', 45)
+    scans.docs.append(scan)
+    compact()
+    (tmp_path / scan['image_archive']).unlink()
+
+    result = asyncio.run(server.get_scan('old', user_id='user-1'))
+
+    assert result['image_degraded'] is True
+    assert result['image_base64'] == scan['thumbnail_base64']
+
+
+def test_get_scans_returns_thumbnail_for_archived_scans(scans):
+    archived = make_scan('old', 45)
+    recent = make_scan('recent', 1)
+    scans.docs.extend([archived, recent])
+    compact()
+
+    result = asyncio.run(server.get_scans(user_id='user-1'))
+
+    by_id = {scan['id']: scan for scan in result}
+    assert by_id['old']['image_base64'] == archived['thumbnail_base64']
+    assert by_id['recent']['image_base64'] == recent['image_base64']
+    for scan in result:
+        assert 'thumbnail_base64' not in scan
+        assert 'image_archive' not in scan
+        assert 'archived_at' not in scan